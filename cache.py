@@ -0,0 +1,54 @@
+"""
+Cache Helper Functions
+
+Redis helper functions for caching pre-serialized API responses.
+Caching is optional: when REDIS_URL is not set (or Redis is unreachable)
+every helper degrades to a no-op and endpoints fall back to MongoDB.
+"""
+
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+
+# Load environment variables from .env file
+load_dotenv()
+
+redis = None
+
+redis_url = os.getenv("REDIS_URL")
+# Short timeouts so a stalled or blackholed Redis falls back to MongoDB
+# instead of hanging the request until the OS TCP timeout
+redis_timeout = float(os.getenv("REDIS_TIMEOUT", 0.1))  # seconds
+
+if redis_url:
+    redis = Redis.from_url(redis_url, socket_connect_timeout=redis_timeout, socket_timeout=redis_timeout)
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """Return cached bytes for key, or None on miss / cache unavailable"""
+    if redis is None:
+        return None
+    try:
+        return await redis.get(key)
+    except Exception:
+        return None
+
+async def cache_set(key: str, value: bytes, ttl: int):
+    """Store bytes under key for ttl seconds"""
+    if redis is None:
+        return
+    try:
+        await redis.setex(key, ttl, value)
+    except Exception:
+        pass
+
+async def cache_invalidate(pattern: str):
+    """Delete every key matching pattern (uses SCAN, never KEYS)"""
+    if redis is None:
+        return
+    try:
+        keys = [key async for key in redis.scan_iter(match=pattern)]
+        if keys:
+            await redis.delete(*keys)
+    except Exception:
+        pass
@@ -3,11 +3,14 @@ Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
+All helpers are coroutines backed by the async Motor driver, so await them
+from `async def` endpoints. Call connect() on startup before using them.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 import os
+from urllib.parse import parse_qs, urlsplit
 from dotenv import load_dotenv
 from typing import Union
 from pydantic import BaseModel
@@ -21,12 +24,49 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Connection pool sizing per worker process. Size maxPoolSize so steady-state
+# traffic keeps the pool around 80% utilized; waitQueueTimeoutMS makes a
+# saturated pool fail fast instead of queueing requests indefinitely.
+# Precedence per option: MONGO_* env var, then DATABASE_URL, then the default
+# here. Large fleets should point DATABASE_URL at a mongos router rather than
+# scaling per-worker pools.
+_pool_defaults = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", 50),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", 5),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", 60000),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000),
+}
+
+def _pool_options(url: str) -> dict:
+    """Pool kwargs for the client, leaving options already set in the URI alone"""
+    # URI option names are case-insensitive
+    uri_options = {key.lower() for key in parse_qs(urlsplit(url).query)}
+    options = {}
+    for option, (env_var, default) in _pool_defaults.items():
+        if os.getenv(env_var):
+            options[option] = int(os.getenv(env_var))
+        elif option.lower() not in uri_options:
+            options[option] = default
+    return options
+
+def connect():
+    """Create the shared client; call from app startup so each worker process gets its own"""
+    global _client, db
+    if db is None and database_url and database_name:
+        _client = AsyncIOMotorClient(database_url, **_pool_options(database_url))
+        db = _client[database_name]
+    return db
+
+def close():
+    """Close the shared client and its pooled connections"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +80,16 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
+    """Get documents from collection, optionally returning only the projected fields"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
@@ -1,46 +1,105 @@
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import time
+import asyncio
+import contextlib
+import hashlib
+import orjson
+from collections import defaultdict
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError, WaitQueueTimeoutError
 
-from database import db, create_document, get_documents
+import database
+from database import create_document, get_documents
+from cache import cache_get, cache_set, cache_invalidate
 from schemas import Systemclip
 
-app = FastAPI(title="SysTok API", description="TikTok-style learning feed for System Software")
+SYSTEMCLIP_COLL = Systemclip.__name__.lower()  # "systemclip"
+# Only the fields Systemclip exposes; keeps _id and bookkeeping fields off the wire
+SYSTEMCLIP_PROJECTION = {"_id": 0, **{name: 1 for name in Systemclip.model_fields}}
+# Values for optional fields older documents may lack, filled in on read
+SYSTEMCLIP_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in Systemclip.model_fields.items()
+    if not field.is_required()
+}
+
+# Set on startup once the database client exists
+clips_coll = None
+
+app = FastAPI(
+    title="SysTok API",
+    description="TikTok-style learning feed for System Software",
+    default_response_class=ORJSONResponse,
+)
+
+# Comma-separated frontend origins, e.g. "https://systok.app"; unset allows any origin
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=cors_origins,
+    # With "*" plus credentials Starlette echoes back any request Origin, letting every
+    # site make credentialed calls; credentials need CORS_ORIGINS to name the frontend
+    allow_credentials="*" not in cors_origins,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,  # let browsers cache preflights for a day
 )
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "SysTok backend is running"}
 
+HEALTH_CACHE_TTL = 5  # seconds
+
+_health_cache = {"at": 0.0, "value": None}
+_health_lock = asyncio.Lock()
+
+def _cached_health():
+    if _health_cache["value"] is not None and time.monotonic() - _health_cache["at"] < HEALTH_CACHE_TTL:
+        return _health_cache["value"]
+    return None
+
 @app.get("/test")
-def test_database():
+async def test_database():
+    # Repeated hits are served from cache; the lock keeps it to one admin command in flight
+    cached = _cached_health()
+    if cached is not None:
+        return cached
+    async with _health_lock:
+        cached = _cached_health()
+        if cached is not None:
+            return cached
+        response = await _check_database()
+        _health_cache.update(at=time.monotonic(), value=response)
+    return response
+
+async def _check_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
         "database_url": None,
         "database_name": None,
         "connection_status": "Not Connected",
-        "collections": []
+        "collections": [],
+        "counter_writes": counter_stats,
     }
 
     try:
-        if db is not None:
+        if database.db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = getattr(db, 'name', None) or "❌ Not Set"
+            response["database_name"] = getattr(database.db, 'name', None) or "❌ Not Set"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await database.db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -52,6 +111,15 @@ def test_database():
 
     return response
 
+# Open the Mongo client per worker at startup (not at import) so pooled
+# connections are never shared across a fork. Registered first so later
+# startup handlers can use the database.
+@app.on_event("startup")
+async def open_database():
+    global clips_coll
+    if database.connect() is not None:
+        clips_coll = database.db[SYSTEMCLIP_COLL]
+
 # --------- API Models ---------
 class LikeAction(BaseModel):
     clip_id: str
@@ -63,51 +131,209 @@ class BookmarkAction(BaseModel):
 
 # --------- Helper ---------
 
-def _collection_name(model_cls) -> str:
-    return model_cls.__name__.lower()
+CLIPS_CACHE_TTL = 60  # seconds
+
+def _clips_cache_key(topic: Optional[str], tag: Optional[str], limit: int) -> str:
+    # JSON-encode the query so a missing param (null) differs from the string "None"
+    # and values containing ":" can't collide with another query
+    # v2: entries are ETag + body (see _clips_response); bump when the stored format changes
+    return "clips:v2:" + orjson.dumps([topic, tag, limit]).decode()
+
+async def _invalidate_clips_cache():
+    await cache_invalidate("clips:*")
+
+CLIPS_CACHE_CONTROL = "public, max-age=30, stale-while-revalidate=60"
+ETAG_LEN = 34  # quoted 16-byte blake2b hex digest
+
+def _etag(body: bytes) -> bytes:
+    return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _clips_response(entry: bytes, if_none_match: Optional[str]) -> Response:
+    # Cache entries are the ETag followed by the JSON body, so hits never re-hash
+    etag, body = entry[:ETAG_LEN].decode(), entry[ETAG_LEN:]
+    headers = {"ETag": etag, "Cache-Control": CLIPS_CACHE_CONTROL}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+_OID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+def _clip_filter(clip_id: str) -> dict:
+    # fullmatch, not match + "$": "$" also accepts a trailing newline
+    if _OID_RE.fullmatch(clip_id):
+        return {"_id": ObjectId(clip_id)}
+    # Not an ObjectId, so match by string id stored as field 'id'
+    return {"id": clip_id}
+
+# --------- Counter batching ---------
+# Likes/bookmarks are buffered per clip and flushed as one bulk_write per
+# interval, so a burst of clicks on a hot clip costs a single Mongo write.
+
+COUNTER_FLUSH_INTERVAL = 0.05  # seconds
+KNOWN_CLIPS_MAX = 10000
+
+_counter_buffer = defaultdict(lambda: {"likes": 0, "bookmarks": 0})
+_counter_lock = asyncio.Lock()
+_counter_task = None
+_counter_stop = asyncio.Event()
+# Background write health, reported by /test since handlers never see these errors
+counter_stats = {"failed_writes": 0, "retried_flushes": 0, "ambiguous_flushes": 0}
+# Filters already confirmed to match a clip; skips the existence probe
+_known_clips = set()
+
+async def _ensure_clip_exists(clip_filter: dict):
+    key = next(iter(clip_filter.items()))
+    if key in _known_clips:
+        return
+    if await clips_coll.find_one(clip_filter, projection={"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail="Clip not found")
+    if len(_known_clips) >= KNOWN_CLIPS_MAX:
+        _known_clips.clear()
+    _known_clips.add(key)
+
+async def buffer_inc(clip_filter: dict, field: str, delta: int):
+    key = next(iter(clip_filter.items()))
+    async with _counter_lock:
+        _counter_buffer[key][field] += delta
+
+async def _flush_counters():
+    async with _counter_lock:
+        if not _counter_buffer:
+            return
+        pending = dict(_counter_buffer)
+        _counter_buffer.clear()
+    ops = []
+    for (field, value), deltas in pending.items():
+        inc = {name: delta for name, delta in deltas.items() if delta}
+        if inc:
+            # updated_at is a timestamp (see create_document); let Mongo stamp it
+            ops.append(UpdateOne({field: value}, {"$inc": inc, "$currentDate": {"updated_at": True}}))
+    if not ops:
+        return
+    try:
+        await clips_coll.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # The other ops were applied; rejected ones would fail again on retry
+        counter_stats["failed_writes"] += len(e.details.get("writeErrors", []))
+    except (ServerSelectionTimeoutError, WaitQueueTimeoutError):
+        # Nothing was sent to the server; put the deltas back so the next flush retries them
+        counter_stats["retried_flushes"] += 1
+        async with _counter_lock:
+            for key, deltas in pending.items():
+                for name, delta in deltas.items():
+                    _counter_buffer[key][name] += delta
+    except Exception:
+        # e.g. AutoReconnect mid-write: the server may already have applied the ops,
+        # so replaying could double count. Counters are at-most-once; drop the batch.
+        counter_stats["ambiguous_flushes"] += 1
+    # No cache invalidation here: counts in the cached feed may lag by up to
+    # CLIPS_CACHE_TTL; the feed is served with a max-age, so stale counts are expected
+
+async def _counter_flusher():
+    # Stopped via _counter_stop rather than cancel(), so an in-flight bulk_write
+    # is never interrupted after its deltas have left the buffer
+    while not _counter_stop.is_set():
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_counter_stop.wait(), COUNTER_FLUSH_INTERVAL)
+        await _flush_counters()
+
+@app.on_event("startup")
+async def start_counter_flusher():
+    global _counter_task
+    if database.db is not None:
+        _counter_stop.clear()
+        _counter_task = asyncio.create_task(_counter_flusher())
+
+@app.on_event("shutdown")
+async def stop_counter_flusher():
+    if _counter_task is not None:
+        _counter_stop.set()
+        # Let the in-flight flush finish, then pick up anything buffered meanwhile
+        await _counter_task
+        await _flush_counters()
+
+_index_task = None
+
+async def _create_indexes():
+    try:
+        # Serve /api/clips topic (+ tag) and tag-only filters from an index; no-op if present
+        await clips_coll.create_index([("topic", 1), ("tags", 1)])
+        await clips_coll.create_index([("tags", 1)])
+    except Exception:
+        # Unreachable database; /test reports it and the next restart retries
+        pass
+
+@app.on_event("startup")
+async def ensure_indexes():
+    global _index_task
+    # Run in the background: with Mongo down, create_index waits out the
+    # server selection timeout, which would hold the worker out of service
+    if database.db is not None:
+        _index_task = asyncio.create_task(_create_indexes())
+
+# Registered after stop_counter_flusher so the final flush still has a client
+@app.on_event("shutdown")
+async def close_database():
+    global clips_coll
+    if _index_task is not None:
+        _index_task.cancel()
+    clips_coll = None
+    database.close()
 
 # --------- Endpoints ---------
 
 @app.get("/api/clips", response_model=List[Systemclip])
-def list_clips(topic: Optional[str] = None, tag: Optional[str] = None, limit: int = 20):
+async def list_clips(
+    topic: Optional[str] = None,
+    tag: Optional[str] = None,
+    limit: int = 20,
+    if_none_match: Optional[str] = Header(None),
+):
     filt = {}
     if topic:
         filt["topic"] = topic
     if tag:
         filt["tags"] = {"$in": [tag]}
+    key = _clips_cache_key(topic, tag, limit)
+    cached = await cache_get(key)
+    if cached is not None:
+        return _clips_response(cached, if_none_match)
     try:
-        docs = get_documents(_collection_name(Systemclip), filt, limit)
-        # Convert ObjectId to string for response compatibility
-        sanitized = []
-        for d in docs:
-            d.pop("_id", None)
-            sanitized.append(d)
-        return sanitized
+        docs = await get_documents(SYSTEMCLIP_COLL, filt, limit, projection=SYSTEMCLIP_PROJECTION)
+        # DB data is pre-validated on insert and projected to Systemclip's fields,
+        # so orjson encodes the dicts directly without building models.
+        body = orjson.dumps([{**SYSTEMCLIP_DEFAULTS, **d} for d in docs])
+        entry = _etag(body) + body
+        await cache_set(key, entry, CLIPS_CACHE_TTL)
+        return _clips_response(entry, if_none_match)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/clips", status_code=201)
-def create_clip(clip: Systemclip):
+async def create_clip(clip: Systemclip):
     try:
-        inserted_id = create_document(_collection_name(Systemclip), clip)
+        inserted_id = await create_document(SYSTEMCLIP_COLL, clip)
+        await _invalidate_clips_cache()
         return {"id": inserted_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/like")
-def like_clip(action: LikeAction):
-    if db is None:
+async def like_clip(action: LikeAction):
+    if database.db is None:
         raise HTTPException(status_code=500, detail="Database not available")
     try:
-        coll = db[_collection_name(Systemclip)]
-        try:
-            oid = ObjectId(action.clip_id)
-            result = coll.update_one({"_id": oid}, {"$inc": {"likes": action.delta, "updated_at": 1}})
-        except Exception:
-            # If a direct ObjectId match fails, also allow by string id stored as field 'id'
-            result = coll.update_one({"id": action.clip_id}, {"$inc": {"likes": action.delta, "updated_at": 1}})
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Clip not found")
+        clip_filter = _clip_filter(action.clip_id)
+        await _ensure_clip_exists(clip_filter)
+        await buffer_inc(clip_filter, "likes", action.delta)
         return {"ok": True}
     except HTTPException:
         raise
@@ -115,74 +341,81 @@ def like_clip(action: LikeAction):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/bookmark")
-def bookmark_clip(action: BookmarkAction):
-    if db is None:
+async def bookmark_clip(action: BookmarkAction):
+    if database.db is None:
         raise HTTPException(status_code=500, detail="Database not available")
     try:
-        coll = db[_collection_name(Systemclip)]
-        try:
-            oid = ObjectId(action.clip_id)
-            result = coll.update_one({"_id": oid}, {"$inc": {"bookmarks": action.delta, "updated_at": 1}})
-        except Exception:
-            result = coll.update_one({"id": action.clip_id}, {"$inc": {"bookmarks": action.delta, "updated_at": 1}})
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Clip not found")
+        clip_filter = _clip_filter(action.clip_id)
+        await _ensure_clip_exists(clip_filter)
+        await buffer_inc(clip_filter, "bookmarks", action.delta)
         return {"ok": True}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Seed data, built once at import; insert_many adds _id, so always insert copies
+SEED_CLIPS = (
+    {
+        "title": "What is a Kernel?",
+        "topic": "OS",
+        "description": "A quick primer on monolithic vs microkernels with visuals.",
+        "video_url": "https://samplelib.com/lib/preview/mp4/sample-5s.mp4",
+        "thumbnail_url": "https://picsum.photos/seed/kernel/400/700",
+        "tags": ["kernel", "os", "linux"],
+        "difficulty": "beginner",
+        "likes": 0,
+        "bookmarks": 0,
+        "author": "SysTok"
+    },
+    {
+        "title": "Page Tables in 60s",
+        "topic": "OS",
+        "description": "Virtual memory, TLBs and multi-level tables.",
+        "video_url": "https://samplelib.com/lib/preview/mp4/sample-5s.mp4",
+        "thumbnail_url": "https://picsum.photos/seed/pagetable/400/700",
+        "tags": ["memory", "paging"],
+        "difficulty": "intermediate",
+        "likes": 0,
+        "bookmarks": 0,
+        "author": "SysTok"
+    },
+    {
+        "title": "Compiler vs Interpreter",
+        "topic": "Compilers",
+        "description": "Key differences and when each is used.",
+        "video_url": "https://samplelib.com/lib/preview/mp4/sample-5s.mp4",
+        "thumbnail_url": "https://picsum.photos/seed/compiler/400/700",
+        "tags": ["compiler", "interpreter"],
+        "difficulty": "beginner",
+        "likes": 0,
+        "bookmarks": 0,
+        "author": "SysTok"
+    },
+)
+
 # Seed some example clips if collection is empty
 @app.post("/api/seed")
-def seed_clips():
-    if db is None:
+async def seed_clips():
+    if database.db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    coll = db[_collection_name(Systemclip)]
-    if coll.count_documents({}) > 0:
+    if await clips_coll.find_one({}, projection={"_id": 1}) is not None:
         return {"message": "Already seeded"}
-    samples = [
-        {
-            "title": "What is a Kernel?",
-            "topic": "OS",
-            "description": "A quick primer on monolithic vs microkernels with visuals.",
-            "video_url": "https://samplelib.com/lib/preview/mp4/sample-5s.mp4",
-            "thumbnail_url": "https://picsum.photos/seed/kernel/400/700",
-            "tags": ["kernel", "os", "linux"],
-            "difficulty": "beginner",
-            "likes": 0,
-            "bookmarks": 0,
-            "author": "SysTok"
-        },
-        {
-            "title": "Page Tables in 60s",
-            "topic": "OS",
-            "description": "Virtual memory, TLBs and multi-level tables.",
-            "video_url": "https://samplelib.com/lib/preview/mp4/sample-5s.mp4",
-            "thumbnail_url": "https://picsum.photos/seed/pagetable/400/700",
-            "tags": ["memory", "paging"],
-            "difficulty": "intermediate",
-            "likes": 0,
-            "bookmarks": 0,
-            "author": "SysTok"
-        },
-        {
-            "title": "Compiler vs Interpreter",
-            "topic": "Compilers",
-            "description": "Key differences and when each is used.",
-            "video_url": "https://samplelib.com/lib/preview/mp4/sample-5s.mp4",
-            "thumbnail_url": "https://picsum.photos/seed/compiler/400/700",
-            "tags": ["compiler", "interpreter"],
-            "difficulty": "beginner",
-            "likes": 0,
-            "bookmarks": 0,
-            "author": "SysTok"
-        },
-    ]
-    coll.insert_many(samples)
+    samples = [dict(clip) for clip in SEED_CLIPS]
+    await clips_coll.insert_many(samples)
+    await _invalidate_clips_cache()
     return {"inserted": len(samples)}
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker imports main:app and opens its own Mongo client on startup
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        # "auto" picks uvloop/httptools when installed (uvloop is skipped on Windows)
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    )